@@ -1,2 +1,4 @@
-from pubchemTools.pubchemTools import Pubchem, get_value, get_cid
-__all__=['Pubchem', 'get_value', 'get_cid']
+from pubchemTools.pubchemTools import Pubchem, get_value, get_cid, clear_cache, \
+        search_many, enable_disk_cache, disable_disk_cache, batch_properties
+__all__=['Pubchem', 'get_value', 'get_cid', 'clear_cache', 'search_many',
+         'enable_disk_cache', 'disable_disk_cache', 'batch_properties']
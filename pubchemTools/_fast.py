@@ -0,0 +1,212 @@
+#/usr/bin/env python
+""" The functions walking through the whole pubchem record:
+    cleaning it up after download and indexing its keys.
+    These run on every node of the record tree, thus they are kept
+    here, typed, so the module can be compiled with mypyc:
+
+        mypyc pubchemTools/_fast.py
+
+    The compiled extension is imported instead of this file if it
+    is found next to it, otherwise this pure python version is used.
+    Everything here uses only dicts, lists and strings.
+
+    Authors: Tomio
+    License: CC-BY(4)
+    Warrany: None
+"""
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# keys used to name the elements of a list, in order of priority
+# see pop_dict_key()
+_POP_KEYS = ('TOCHeading', 'Name', 'ReferenceNumber')
+_POP_SET = frozenset(_POP_KEYS)
+
+# marks a missing key for dict.get() and dict.pop(),
+# where None may be a valid value
+_MISSING = object()
+
+
+def _value_strings(value: Any)->Any:
+    """ the strings of a StringWithMarkup list, None if there are none
+    """
+    if value and 'String' in value[0]:
+        return [i['String'] for i in value]
+
+    return None
+
+
+def _value_single(value: Any)->Any:
+    """ Number and Boolean lists: unpack if there is only one element
+    """
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+
+    return value
+
+
+# value types in a 'Value' dict, and how to get the value out of them,
+# checked in this order by dig_value()
+_VALUE_HANDLERS: Dict[str, Callable[[Any], Any]] = {
+        'StringWithMarkup': _value_strings,
+        'Number': _value_single,
+        'Boolean': _value_single}
+
+
+def dig_value(info: Any)->Optional[dict]:
+    """ pubchem records tend to have a 'Value' key,
+        under which a list of dicts list up values
+        with details for references, and value types
+        like String, Numeric, Boolean...
+        Dig into these to get the actual values out, because
+        python allow to have any of these without extra specifications.
+        This makes the structure of the record simpler.
+
+        parameters:
+        info:       key within a dict of dicts
+
+        return:
+        a dict {'value': value}
+    """
+    if isinstance(info, str):
+        return {'value': info}
+
+    if not isinstance(info, dict):
+        return None
+
+    for k, handler in _VALUE_HANDLERS.items():
+        value = info.get(k, _MISSING)
+        if value is not _MISSING:
+            value = handler(value)
+            if value is not None:
+                return {'value': value}
+
+    # print('Unknown value structure!')
+    return info
+# end dig_value
+
+
+def pop_dict_key(info: dict)->str:
+    """ Take a dict and look for a specific key in it,
+        pop and return this key.
+        Potential keys:
+        TOCHeading, Name, ReferenceNumber
+
+        This helper function is used to get a key for
+        list of dicts, like a section, to turn the
+        list to a dict with the key we provide here
+
+        @parameter info:    the element in a section
+
+        @return: the key found
+    """
+    hits = info.keys() & _POP_SET
+    if not hits:
+        return ''
+
+    if len(hits) == 1:
+        return hits.pop()
+
+    # more keys found, keep the priority of the list
+    for i in _POP_KEYS:
+        if i in hits:
+            return i
+
+    return ''
+# end pop_dict_key
+
+
+def clean_section(info: Any)->dict:
+    """ Take a dict returned by Pubchem (within the Record field) and scan it,
+        extract the Section lists and put them into the original dict with keys
+        obtained from the TOCHeading fields.
+        The tree is walked using a stack instead of recursion, in the same
+        order as a recursive walk would do.
+    """
+    update_list = ['Section', 'Information', 'Value']
+
+    res: dict = {}
+    # work items are (target, key, node):
+    # if key is None, node is cleaned into the target dict,
+    # else it is simply stored as target[key]
+    todo: Deque[Tuple[dict, Any, Any]] = deque([(res, None, info)])
+
+    while todo:
+        target, key, node = todo.pop()
+
+        if key is not None:
+            target[key] = node
+
+        elif isinstance(node, dict):
+            # push in reversed order, so we pop them in the original one
+            todo.extend((target, None, v) if k.lower() == 'section'
+                        else (target, k, v)
+                        for k, v in reversed(node.items()))
+
+        elif isinstance(node, list):
+            # a list should be a list of dicts
+            sub_jobs: List[Tuple[dict, Any, Any]] = []
+
+            # Here we cannot deal with list elements that are
+            # not dicts, they are skipped (keeping their index for the keys)
+            dict_items = ((j, i) for j, i in enumerate(node)
+                          if isinstance(i, dict))
+
+            for j,i in dict_items:
+                # what shall be a key?
+                # to add the list elements to the root dict,
+                # we need a key... Candidates are in the pop_list
+                # we hunt for a specific key, its value
+                # is used as key for the whole element, and be dropped
+                # (ReferenceNumber values are int)
+                k = pop_dict_key(i)
+                name: Any = i.pop(k) if k else str(j)
+
+                # update what to be updated
+                for update_i in update_list:
+                    i_subdict = i.pop(update_i, _MISSING)
+                    if i_subdict is not _MISSING:
+                        if update_i == 'Value':
+                            new_value = dig_value(i_subdict)
+                            # values we cannot interpret are dropped
+                            if new_value is not None:
+                                i.update(new_value)
+                        else:
+                            # cleaned later into the element itself
+                            sub_jobs.append((i, None, i_subdict))
+                        break
+
+                # now, store the result:
+                target[name] = i
+
+            todo.extend(reversed(sub_jobs))
+        else:
+            print("Unknown data", node)
+    return res
+# end of clean_section
+
+
+def _build_key_index(data: dict)->dict:
+    """ walk the dict tree once, and collect every value under its key,
+        so later searches need not to walk the whole tree again.
+        Lists are entered, and dicts within are also indexed.
+
+        @param data:    the pubchem record to index
+
+        @return: a dict of {key: [values found under this key]}
+    """
+    index: Dict[Any, list] = {}
+    todo: Deque[dict] = deque([data])
+
+    while todo:
+        node = todo.popleft()
+        for k, v in node.items():
+            index.setdefault(k, []).append(v)
+
+            if isinstance(v, dict):
+                todo.append(v)
+            elif isinstance(v, list):
+                todo.extend(i for i in v if isinstance(i, dict))
+
+    return index
+# end _build_key_index
@@ -12,89 +12,249 @@
     Warrany: None
 """
 # handle pubchem entries the hard way:
-import json
+import copy
+import functools
+import gzip
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+
+# orjson is much faster on the large records, but optional
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
 
 # some tricks to manipulate the dict tree
 from dictDigUtils import dict_search_in_key
-#from . ghs_code import *
-
-__all__ = ['Pubchem', 'get_value', 'get_cid']
+# the walks over the whole record, compiled if available (see _fast)
+from ._fast import clean_section, dig_value, pop_dict_key, \
+        _build_key_index, _MISSING
+# the meaning of the H and P codes
+from .ghs_code import ghs
+
+__all__ = ['Pubchem', 'get_value', 'get_cid', 'clear_cache', 'search_many',
+           'enable_disk_cache', 'disable_disk_cache', 'batch_properties']
+
+# one session for all calls, so the connection to pubchem (TCP and TLS)
+# is kept alive and reused between the cid and the full record requests
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_SESSION.headers.update({'Accept': 'application/json',
+                         'User-Agent': 'pubchemTools/1.0'})
+
+# pubchem asks users not to send more than 5 requests per second,
+# so the calls are spaced by at least this many seconds, see _wait_for_turn()
+_MIN_INTERVAL = 0.2
+_LAST_REQUEST = 0.0
+_RATE_LOCK = threading.Lock()
+
+# the parallel calls in search_many(), more would only wait for their turn
+_MAX_WORKERS = 5
+
+
+def _wait_for_turn():
+    """ wait until the next request to pubchem may be sent,
+        keeping at least _MIN_INTERVAL seconds between any two
+        requests, also across threads.
+        Every call reserves its own time slot, and sleeps until then.
+    """
+    global _LAST_REQUEST
+
+    with _RATE_LOCK:
+        now = time.monotonic()
+        turn = max(now, _LAST_REQUEST + _MIN_INTERVAL)
+        _LAST_REQUEST = turn
+
+    if turn > now:
+        time.sleep(turn - now)
+# end _wait_for_turn
+
+
+# successful search results kept in memory, the least recently
+# used ones are dropped above the size, see _search_cached()
+_SEARCH_CACHE = OrderedDict()
+_SEARCH_CACHE_SIZE = 256
+_SEARCH_CACHE_LOCK = threading.Lock()
+
+# where and how long to keep the search results on disk,
+# None if disabled, see enable_disk_cache()
+_DISK_CACHE = None
+
+# pug property names and the record headings they correspond to,
+# so the Pubchem properties find them, see Pubchem.from_property_row()
+_PROPERTY_HEADINGS = {'MolecularWeight': 'Molecular Weight',
+                      'MolecularFormula': 'Molecular Formula',
+                      'CanonicalSMILES': 'Canonical SMILES',
+                      'IsomericSMILES': 'Isomeric SMILES',
+                      'ConnectivitySMILES': 'Connectivity SMILES',
+                      'SMILES': 'SMILES',
+                      'IUPACName': 'IUPAC Name',
+                      'InChI': 'InChI',
+                      'InChIKey': 'InChIKey'}
+
+# GHS hazard and precautionary codes, like H225, H360FD, H300+H310
+# or P305+P351+P338, see get_ghs()
+_H_RE = re.compile(r'\bH\d{3}[A-Za-z]{0,2}(?:\+H\d{3}[A-Za-z]{0,2})*\b')
+_P_RE = re.compile(r'\bP\d{3}(?:\+P\d{3})*\b')
 
 
 class Pubchem():
     """ an envelop for pubchem searches
         Use it by searching for an object. Its init will use a search,
         by whatever is requested...
+        The values are dug out from the record at the first access,
+        and kept for later calls.
+        Records (and their key index) are shared between instances
+        searching for the same thing, so do not modify them in place.
+
+        With lazy=True the record is kept as pubchem sent it, and only
+        the sections needed for a value are cleaned up when asked for.
+        This is faster if only a few values are used.
     """
+    # (search_string, search_type, lazy) -> (record, index)
+    # the least recently used ones are dropped above _SEARCH_CACHE_SIZE,
+    # like in the search cache, and guarded by the same lock
+    _record_cache: OrderedDict = OrderedDict()
 
-    def __init__(self, search_string: str ='', search_type: str ='name'):
+    def __init__(self, search_string: str ='', search_type: str ='name',
+                 lazy: bool =False):
         """ parameters are passed to search direclty to search
+            lazy:   do not clean up the whole record, only the
+                    parts used by the properties
         """
         self._record_ = {}
+        self._index_ = {}
+
+        if not search_string:
+            return
+
+        key = (search_string, search_type, lazy)
+        with _SEARCH_CACHE_LOCK:
+            if key in Pubchem._record_cache:
+                Pubchem._record_cache.move_to_end(key)
+                self._record_, self._index_ = Pubchem._record_cache[key]
+                return
 
-        if search_string:
+        if lazy:
+            # get_value digs into the raw record as needed
+            self._record_= search(search_string, search_type, 'raw')
+        else:
             self._record_= search(search_string, search_type, 'all')
+            # walk the tree once, the properties look up keys in this index
+            self._index_ = _build_key_index(self._record_)
+
+        # failed searches are not kept, so they can be tried again
+        if self._record_:
+            with _SEARCH_CACHE_LOCK:
+                Pubchem._record_cache[key] = (self._record_, self._index_)
+                if len(Pubchem._record_cache) > _SEARCH_CACHE_SIZE:
+                    Pubchem._record_cache.popitem(last= False)
     # end __init__()
 
 
+    @classmethod
+    def clear_cache(cls):
+        """ forget the records shared between the instances
+        """
+        with _SEARCH_CACHE_LOCK:
+            cls._record_cache.clear()
+
+
+    @classmethod
+    def from_property_row(cls, row: dict):
+        """ create a Pubchem object from a row returned by batch_properties,
+            without downloading the full record.
+            Only the values in the row are available, e.g.
+            molecular_weight, molecular_formula, smiles, iupac_name.
+
+            @param row: a dict of {property: value}, with a CID key
+
+            @return: a Pubchem object
+        """
+        record = {}
+        for k, v in row.items():
+            if k == 'CID':
+                record['RecordNumber'] = v
+            elif k == 'Title':
+                record['RecordTitle'] = v
+            else:
+                # make it look like a cleaned section, so get_value finds it
+                value = [v] if isinstance(v, str) else v
+                record[_PROPERTY_HEADINGS.get(k, k)] = {'value': value}
+
+        res = cls()
+        res._record_ = record
+        res._index_ = _build_key_index(record)
+        return res
+
+
     @property
     def to_dict(self)->dict:
         """ convert all class values to a dict structure,
             with names as keys and values as values.
+            The names are listed in _EXPORT_PROPS.
         """
-        drop_list = ['CAS', 'to_dict']
-        names = [i for i in dir(self) if i[0] != '_' and i not in drop_list]
-        # here we may also employ
-        # names.sort()
-        # but it is not that important...
-        # now, make a dict:
-        return {i: getattr(self, i) for i in names}
+        return {i: getattr(self, i) for i in self._EXPORT_PROPS}
 
 
-    @property
+    @functools.cached_property
     def molecular_weight(self)->float:
         """ Molecular Weight
         """
-        res = get_value('Molecular Weight', self._record_)
+        res = get_value('Molecular Weight', self._record_, self._index_)
         if res:
             return float(res[0])
 
         return -1.0
 
 
-    @property
+    @functools.cached_property
     def ghs(self)->list:
         """ all safety codes (H and F codes)
             accessed by searching for the actua H..., P...
             strings in the values of the data tree.
         """
-        return get_ghs(self._record_)
+        return get_ghs(self._record_, self._index_)
 
-    @property
-    def translage_ghs(self)->list:
+    @functools.cached_property
+    def translate_ghs(self)->dict:
         """ translate the codes to meaningful text
             based on information downloaded from GHS at
             https://pubchem.ncbi.nlm.nih.gov/ghs/
+            Codes missing from the table are kept as they are.
         """
-        indx = self.ghs
-        res= dict()
-        keys=['H-codes', 'P-codes']
-        for i in keys:
-            if i in indx and indx[i]:
-                res[i] = [ghs[k] for k in indx[i]]
-        return res
+        codes = self.ghs
+        return {k: [ghs.get(c, c) for c in codes[k]]
+                for k in ('H-codes', 'P-codes') if codes.get(k)}
 
     @property
+    def translage_ghs(self)->dict:
+        """ the old (misspelled) name of translate_ghs, kept for
+            compatibility, to be dropped in a later major version
+        """
+        return self.translate_ghs
+
+    @functools.cached_property
     def cas(self)->list:
         """ chemical abstracts service codes as list
             Searching for CAS, Related CAS and Deprecated CAS
             in the whole record.
         """
-        return get_value_filtered('CAS', self._record_, ['Related CAS', 'Deprecated CAS'])
+        return get_value_filtered('CAS', self._record_,
+                                  ['Related CAS', 'Deprecated CAS'],
+                                  self._index_)
 
 
-    @property
+    @functools.cached_property
     def density(self)->list:
         """ Get the density out of the data.
             Unfortunately, there are many variant of this,
@@ -108,10 +268,11 @@ class Pubchem():
             For first, we just return the list we find,
             and filter for vapor density
         """
-        return get_value_filtered('Density', self._record_, ['Vapor'])
+        return get_value_filtered('Density', self._record_, ['Vapor'],
+                                  self._index_)
 
 
-    @property
+    @functools.cached_property
     def name(self)->str:
         """ RecordTitle from the pubchem record
         """
@@ -121,7 +282,7 @@ class Pubchem():
         return ''
 
 
-    @property
+    @functools.cached_property
     def cid(self)->int:
         """ pubchem record ID, cid
             Actually the RecordNumber.
@@ -132,42 +293,42 @@ class Pubchem():
         return -1
 
 
-    @property
+    @functools.cached_property
     def iupac_name(self)->str:
         """ IUPAC name
         """
-        res= get_value('IUPAC', self._record_)
+        res= get_value('IUPAC', self._record_, self._index_)
         if res:
             return res[0]
 
         return ''
 
 
-    @property
+    @functools.cached_property
     def inchi(self)->list:
         """ The InChI of the chemical
             A list, where one field is the InChiKey, the other is
             the actua InChI
         """
-        res = get_value('InChI', self._record_)
+        res = get_value('InChI', self._record_, self._index_)
         if res:
             return res
 
         return ''
 
 
-    @property
+    @functools.cached_property
     def molecular_formula(self)->list:
         """ Molecular formula, as list, because there may be variants
         """
-        return get_value('Molecular Formula', self._record_)
+        return get_value('Molecular Formula', self._record_, self._index_)
 
 
-    @property
+    @functools.cached_property
     def smiles(self)->str:
         """ The SMILES descriptor of the molecule
         """
-        res= get_value('SMILES', self._record_)
+        res= get_value('SMILES', self._record_, self._index_)
 
         if res:
             return res[-1]
@@ -175,11 +336,17 @@ class Pubchem():
         return ''
 
 
-    @property
+    @functools.cached_property
     def synonyms(self)->list:
         """ the list of synonyms from the record
         """
-        return get_value('Synonym', self._record_)
+        return get_value('Synonym', self._record_, self._index_)
+
+
+    # the values exported by to_dict
+    _EXPORT_PROPS = ('cas', 'cid', 'density', 'ghs', 'inchi', 'iupac_name',
+                     'molecular_formula', 'molecular_weight', 'name',
+                     'smiles', 'synonyms', 'translage_ghs')
 # end class Pubchem
 
 
@@ -189,6 +356,7 @@ def search(search_string: str ='', search_type: str ='name', what: str ='cids')-
         Return information based on what. If 'cids', then a list of CIDs,
         if 'all', then a full record.
         The full record is cleaned up a bit for easier access and search.
+        If 'raw', then the full record as pubchem sent it.
         Use the helpers to find out actual values...
 
         About synonyms: all are found as name, but some are tricky.
@@ -198,6 +366,12 @@ def search(search_string: str ='', search_type: str ='name', what: str ='cids')-
         search_string:  information to search for, e.g. chemical name
         search_type:    type of information, e.g. name, CAS, formula, cid
         what:           what to return? E.g. cids or record or all (all details)
+                        or raw (all details without the clean up)
+
+        Results are kept in memory (and on disk, see enable_disk_cache),
+        and the same list or dict is returned for the same search again.
+        Do not modify them in place (e.g. with dict_flatten), copy them
+        first, else later searches and Pubchem objects get the changes!
 
         Return:
         list of found Pumbed IDs = CID values
@@ -206,6 +380,98 @@ def search(search_string: str ='', search_type: str ='name', what: str ='cids')-
         print('Empty query')
         return []
 
+    return _search_cached(search_string, search_type, what)
+# end search
+
+
+def _search_cached(search_string, search_type: str, what: str)->dict:
+    """ the search behind search()
+        Results are kept in memory, so asking for the same compound
+        again does not go to pubchem again.
+        Failed searches (empty results) are not kept, so they can be
+        tried again, e.g. after the server was busy.
+        The returned objects are shared between the calls, do not
+        modify them in place!
+    """
+    key = (search_string, search_type, what)
+
+    with _SEARCH_CACHE_LOCK:
+        if key in _SEARCH_CACHE:
+            _SEARCH_CACHE.move_to_end(key)
+            return _SEARCH_CACHE[key]
+
+    result = _search_stored(search_string, search_type, what)
+
+    if result:
+        with _SEARCH_CACHE_LOCK:
+            _SEARCH_CACHE[key] = result
+            if len(_SEARCH_CACHE) > _SEARCH_CACHE_SIZE:
+                _SEARCH_CACHE.popitem(last= False)
+
+    return result
+# end _search_cached
+
+
+def _search_stored(search_string, search_type: str, what: str)->dict:
+    """ If the disk cache is enabled, the results are looked up
+        and stored there (see enable_disk_cache), else this is
+        simply the web search.
+    """
+    if _DISK_CACHE is None:
+        return _search_web(search_string, search_type, what)
+
+    key = repr((search_string, search_type, what)).encode('utf-8')
+    filename = os.path.join(_DISK_CACHE['path'],
+                            f'{hashlib.sha1(key).hexdigest()}.pkl.gz')
+
+    if (os.path.isfile(filename)
+        and time.time() - os.path.getmtime(filename) < _DISK_CACHE['ttl']):
+        try:
+            with gzip.open(filename, 'rb') as fp:
+                return pickle.load(fp)
+        except Exception:
+            # truncated or damaged file (e.g. zlib.error), it gets
+            # overwritten below
+            print('Broken cache file, asking pubchem again:', filename)
+
+    result = _search_web(search_string, search_type, what)
+
+    # failed searches are not stored, so they can be tried again
+    if result:
+        # write to a temporary file first, so others never read half a file,
+        # its name is unique, so parallel threads do not share it
+        tmpname = None
+        try:
+            # the cache folder may be gone or read only by now
+            fd, tmpname = tempfile.mkstemp(dir= _DISK_CACHE['path'],
+                                           suffix= '.tmp')
+            # GzipFile does not close a file it was given, so close both
+            with os.fdopen(fd, 'wb') as raw, \
+                    gzip.GzipFile(fileobj= raw, mode= 'wb') as fp:
+                pickle.dump(result, fp)
+            os.replace(tmpname, filename)
+            tmpname = None
+
+        except Exception as err:
+            # we have the result, a failed cache write (disk or pickling)
+            # should not lose it
+            print('Could not write the cache file:', err)
+
+        finally:
+            # if anything failed, drop the half written file
+            if tmpname and os.path.exists(tmpname):
+                try:
+                    os.remove(tmpname)
+                except OSError:
+                    pass
+
+    return result
+# end _search_stored
+
+
+def _search_web(search_string, search_type: str, what: str)->dict:
+    """ the actual web call and cleanup behind search()
+    """
     # we get the full record using the pug-rest API
     domain = 'compound'
 
@@ -217,240 +483,317 @@ def search(search_string: str ='', search_type: str ='name', what: str ='cids')-
     # so we use an indicator, and we do a search for 'cid's
     # we can use to retrieve the data or send to FURTHRmind
     all_what = False
+    raw = what == 'raw'
 
-    if what == 'all':
+    if what in ('all', 'raw'):
         all_what = True
         what = 'cids'
 
-    with requests.request(method='GET',
-                        url=f"{mainlink}/{search_string}/{what}/JSON",
+    cids = [i.strip() for i in str(search_string).split(',') if i.strip()]
+
+    if (all_what and search_type == 'cid'
+        and cids and all(i.isdigit() for i in cids)):
+        # the search string is already the CID (or a comma separated
+        # list of them), pug_view can take it directly, and tells if
+        # the record does not exist. No need for the first round trip.
+        # (If only the CIDs are asked for, pubchem still checks them.)
+        result = {'IdentifierList': {'CID': [int(i) for i in cids]}}
+
+    else:
+        # pug_view accepts only record numbers, not names or formulas,
+        # so for these we have to ask for the CID first
+        _wait_for_turn()
+        with _SESSION.get(f"{mainlink}/{search_string}/{what}/JSON",
                           timeout= 30) as a:
-        # We have sent the request, what did the server reply?
-        # status_code == 200 --> all fine, we got a meaningful content back
-        # all others are some kind of reasons why we did not ...
-        if a.status_code == 200:
-            result= json.loads(a.text)
-        else:
-            print('call returned:', a.status_code, a.text)
+            # We have sent the request, what did the server reply?
+            # status_code == 200 --> all fine, we got a meaningful content back
+            # all others are some kind of reasons why we did not ...
+            if a.status_code == 200:
+                result= _loads(a.content)
+            else:
+                print('call returned:', a.status_code, a.text)
     # end calling the API for CIDs
 
-    if (what == 'cids'
-        and not all_what
-        and 'IdentifierList' in result
-        and 'CID' in result['IdentifierList']):
+    if not all_what:
+        # no full record was asked for, we are done
+        if (what == 'cids'
+            and 'IdentifierList' in result
+            and 'CID' in result['IdentifierList']):
 
-        return result['IdentifierList']['CID']
+            return result['IdentifierList']['CID']
 
-    if all_what:
-        # refine the search to a more complete one
-        # but now we can ride another API for the full record
-        # print(result.keys())
+        return result
 
-        if result == {}:
-            print("Nothing found")
-            return result
+    # refine the search to a more complete one
+    # but now we can ride another API for the full record,
+    # using the CID list we have already
+    res = result.get('IdentifierList', {}).get('CID', [])
 
-        res = result['IdentifierList']['CID']
+    if not res:
+        print("Nothing found")
+        return {}
 
-        if len(res) > 1:
-            print('we restrict to the first full record')
+    if len(res) > 1:
+        print('we restrict to the first full record')
 
-        url = "https://pubchem.ncbi.nlm.nih.gov/rest/"\
-              f"pug_view/data/compound/{res[0]}/JSON/?"\
-              "response_type=display"
+    url = "https://pubchem.ncbi.nlm.nih.gov/rest/"\
+          f"pug_view/data/compound/{res[0]}/JSON/?"\
+          "response_type=display"
 
-        with requests.request(method= 'GET', url= url, timeout= 30) as a:
-            result= json.loads(a.text)
+    result = {}
+    _wait_for_turn()
+    with _SESSION.get(url, timeout= 30) as a:
+        # error pages may not even be JSON
+        if a.status_code == 200:
+            result= _loads(a.content)
 
-        if a.status_code == 200 and 'Record' in result:
-            # result = dict_flatten(clean_section(result['Record']))
-            result = clean_section(result['Record'])
-        else:
-            print('For the full request, server responded:', a.status_code)
-            result = {}
+    if 'Record' in result:
+        # result = dict_flatten(clean_section(result['Record']))
+        result = result['Record'] if raw else clean_section(result['Record'])
+    else:
+        print('For the full request, server responded:', a.status_code)
+        result = {}
 
     return result
-# end search
+# end _search_web
 
 
-def get_cid(search_string):
-    """ a shortcut to search, returning the CID of a compound based on
-        name or CAS number.
+def enable_disk_cache(path: str =None, ttl_days: float =30):
+    """ keep the search results also on disk, so running the same
+        script again does not need to ask pubchem again.
+        Results older than ttl_days are fetched again.
 
-        Paramter:
-        search_string: text to be searched for, name or CAS number typically
-
-        Return:
-        a list of found Pubchem CIDs
+        Parameters:
+        path:       the folder to store the results in,
+                    default is ~/.cache/pubchemTools
+        ttl_days:   how long the results are valid in days
     """
-    return search(search_string, 'name', 'cids')
-# end get_cid
+    global _DISK_CACHE
 
+    if path is None:
+        path = os.path.join(os.path.expanduser('~'), '.cache', 'pubchemTools')
 
-def dig_value(info)->dict:
-    """ pubchem records tend to have a 'Value' key,
-        under which a list of dicts list up values
-        with details for references, and value types
-        like String, Numeric, Boolean...
-        Dig into these to get the actual values out, because
-        python allow to have any of these without extra specifications.
-        This makes the structure of the record simpler.
+    os.makedirs(path, exist_ok= True)
+    _DISK_CACHE = {'path': path, 'ttl': ttl_days * 86400}
+# end enable_disk_cache
 
-        parameters:
-        info:       key within a dict of dicts
 
-        return:
-        a dict {'value': value}
+def disable_disk_cache():
+    """ stop using the disk cache, the files are left where they are
     """
-    res = {}
+    global _DISK_CACHE
+    _DISK_CACHE = None
+# end disable_disk_cache
 
 
-    if isinstance(info, str):
-        res['value'] =  info
+def clear_cache():
+    """ drop all records kept in memory from earlier searches,
+        so the next search goes to pubchem again
+    """
+    with _SEARCH_CACHE_LOCK:
+        _SEARCH_CACHE.clear()
+    Pubchem.clear_cache()
+# end clear_cache
 
-    if isinstance(info, dict):
-        if ('StringWithMarkup' in info
-            and 'String' in info['StringWithMarkup'][0]):
 
-            res['value']= [i['String'] for i in info['StringWithMarkup']]
+def search_many(strings, search_type: str ='name', what: str ='all',
+                max_workers: int =_MAX_WORKERS)->dict:
+    """ run search() for many strings in parallel threads, sharing the
+        same connection pool. Waiting for the network dominates a search,
+        so the threads can run while the others wait.
 
-        elif 'Number' in info:
-            if (isinstance(info['Number'], list)
-                and len(info['Number']) == 1):
+        Pubchem allows up to 5 requests per second for a user (and
+        a full record needs two of them). All requests of this module
+        are spaced by at least 0.2 s (also across the threads), so the
+        threads only overlap the waiting for the replies, and max_workers
+        is limited to 5.
 
-                res['value']= info['Number'][0]
-            else:
-                res['value'] = info['Number']
+        Parameters:
+        strings:        a list of information to search for, e.g. names
+        search_type:    type of information, e.g. name, CAS, formula, cid
+        what:           what to return? see search()
+        max_workers:    number of parallel calls, at most 5
 
-        elif 'Boolean' in info:
-            if (isinstance(info['Boolean'], list)
-                and len(info['Boolean']) == 1):
-                res['value'] = info['Boolean'][0]
-            else:
-                res['value']=info['Boolean']
-        else:
-            # print('Unknown value structure!')
-            return info
+        Return:
+        a dict of {search string: search result}
+    """
+    # the same string is searched only once
+    strings = list(dict.fromkeys(strings))
+    if not strings:
+        return {}
 
-    if 'value' in res:
-        return res
-    # else
-    return None
-# end dig_value
+    max_workers = max(1, min(max_workers, _MAX_WORKERS, len(strings)))
 
+    with ThreadPoolExecutor(max_workers= max_workers) as pool:
+        results = pool.map(lambda s: search(s, search_type, what), strings)
 
-def pop_dict_key(info: dict)->str:
-    """ Take a dict and look for a specific key in it,
-        pop and return this key.
-        Potential keys:
-        TOCHeading, Name, ReferenceNumber
+        return dict(zip(strings, results))
+# end search_many
 
-        This helper function is used to get a key for
-        list of dicts, like a section, to turn the
-        list to a dict with the key we provide here
 
-        @parameter info:    the element in a section
+def batch_properties(cids,
+                     props=('MolecularWeight', 'MolecularFormula',
+                            'CanonicalSMILES', 'IUPACName'))->dict:
+    """ get some properties of many compounds in a single call,
+        using the property table of the pug API.
+        This is much faster than downloading all full records, if
+        only these values are needed.
+        Pubchem.from_property_row() turns a row into a Pubchem object.
 
-        @return: the key found
+        Parameters:
+        cids:   a list of pubchem CIDs
+        props:  the property names, as the pug API knows them
+                (e.g. MolecularWeight, MolecularFormula, SMILES, IUPACName,
+                InChI, InChIKey, Title)
+
+        Return:
+        a dict of {cid: {property: value}}, each row has the CID too
     """
-    pop_list = ['TOCHeading', 'Name', 'ReferenceNumber']
-    for i in pop_list:
-        if i in info:
-            return i
+    cids = [str(i) for i in cids]
+    if not cids or not props:
+        return {}
+
+    url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/"\
+          f"property/{','.join(props)}/JSON"
+
+    # the CID list goes into the body, so long lists fit too
+    _wait_for_turn()
+    with _SESSION.post(url, data= {'cid': ','.join(cids)}, timeout= 30) as a:
+        if a.status_code != 200:
+            print('call returned:', a.status_code, a.text)
+            return {}
+
+        result = _loads(a.content)
+
+    rows = result.get('PropertyTable', {}).get('Properties', [])
 
-    return ''
-# end pop_dict_key
+    return {i['CID']: i for i in rows if 'CID' in i}
+# end batch_properties
+
+
+def get_cid(search_string):
+    """ a shortcut to search, returning the CID of a compound based on
+        name or CAS number.
+
+        Paramter:
+        search_string: text to be searched for, name or CAS number typically
 
+        The list is shared with later calls (see search), do not modify it.
 
-def clean_section(info)->dict:
-    """ Take a dict returned by Pubchem (within the Record field) and scan it,
-        extract the Section lists and put them into the original dict with keys
-        obtained from the TOCHeading fields.
+        Return:
+        a list of found Pubchem CIDs
     """
-    update_list = ['Section', 'Information', 'Value']
+    return search(search_string, 'name', 'cids')
+# end get_cid
 
-    res = {}
-    if isinstance(info, dict):
-        for k, v in info.items():
-            if k.lower() == 'section':
-                res.update(clean_section(v))
-            else:
-                res[k] = v
-
-    elif isinstance(info, list):
-        # a list should be a list of dicts
-
-        for j,i in enumerate(info):
-            # what shall be a key?
-            # to add the list elements to the root dict,
-            # we need a key... Candidates are in the pop_list
-            # Here we cannot deal with list elements that are
-            # not dicts!
-            if not isinstance(i, dict):
-                continue
-
-            # we hunt for a specific key, its value
-            # is used as key for the whole element, and be dropped
-            k = pop_dict_key(i)
-            if k:
-                k = i.pop(k)
-            else:
-                k = str(j)
 
-            # update what to be updated
-            for update_i in update_list:
-                if update_i in i:
-                    i_subdict = i.pop(update_i)
-                    new_value = clean_section(i_subdict) if update_i!='Value'\
-                            else dig_value(i_subdict)
+def _get_value_indexed(search_text: str, index: dict)->list:
+    """ the same as dict_search_in_key, but using the index
+        built by _build_key_index: collect all values under
+        keys containing search_text
 
-                    i.update(new_value)
-                    break
+        @param search_text: the key to look for
+        @param index:       the index of the record
+
+        @return: a list of hits
+    """
+    res = []
+    for k, v in index.items():
+        if isinstance(k, str) and search_text in k:
+            res += v
 
-            # now, store the result:
-            res[k] = i
-    else:
-        print("Unknown data", info)
     return res
-# end of clean_section
+# end _get_value_indexed
+
+
+def _clean_matching(search_text: str, record: dict)->list:
+    """ the lazy version of dict_search_in_key for a raw record:
+        walk only the headings of the sections and find the ones
+        which would get a key containing search_text by clean_section.
+        Only these parts are cleaned up, and the rest is left alone.
+
+        @param search_text: the key to look for
+        @param record:      the raw pubchem Record
 
+        @return: a list of the cleaned hits
+    """
+    found = []
+    todo = deque(record.get('Section', []))
+
+    while todo:
+        node = todo.popleft()
+        if not isinstance(node, dict):
+            continue
+
+        k = pop_dict_key(node)
+        if k and isinstance(node[k], str) and search_text in node[k]:
+            # like dict_search_in_key, we do not go deeper in a hit
+            found.append(node)
+            continue
+
+        # clean_section handles only the first of these
+        sub = node.get('Section', _MISSING)
+        if sub is _MISSING:
+            sub = node.get('Information', ())
+        todo.extend(sub)
+
+    # the raw record may be shared, and clean_section modifies its input
+    # one by one, because the same heading may show up at several places
+    return [v for i in found for v in clean_section([copy.deepcopy(i)]).values()]
+# end _clean_matching
+
+
+def _collect_values(res_list: list)->list:
+    """ dig the value fields out from the found elements,
+        and return their content made unique
+        Values may be single items or lists of them, the latter
+        are flattened.
+    """
+    # collecting into a set makes the results unique on the fly
+    res = set()
+    for v in res_list:
+        if not isinstance(v, dict):
+            continue
+
+        for item in dict_search_in_key('value', v):
+            if isinstance(item, list):
+                res.update(item)
+            elif item is not None:
+                res.add(item)
 
-def get_value(search_text: str, data: dict)->list:
+    return list(res)
+# end _collect_values
+
+
+def get_value(search_text: str, data: dict, index: dict =None)->list:
     """ search for search_text in data, using dict_search_key,
         and then dig for value fields within and return their
         content.
 
         @param search_text: the key to look for
         @param  data:       the pubchem_search data to dig into
+        @param index:       optional key index of data (see _build_key_index),
+                            if provided, data is not walked through
+
+        If data is a raw record (has a Section list), only the matching
+        sections are cleaned up and searched.
 
         @return: a list of hits
     """
+    if index:
+        return _collect_values(_get_value_indexed(search_text, index))
 
-    res_list = dict_search_in_key(search_text, data)
-
-    res = []
-    for v in res_list:
-        if isinstance(v, dict):
-            res_line = dict_search_in_key('value', v)
-
-            if res_line:
-                if isinstance(res_line[0], list):
-                    res += [i for j in res_line for i in j]
-                else:
-                    res += res_line
-
-    # make the results unique
-    if res:
-        return list(set(res))
+    if 'Section' in data:
+        return _collect_values(_clean_matching(search_text, data))
 
-    # else
-    return []
+    return _collect_values(dict_search_in_key(search_text, data))
 # end get_value
 
 
 def get_value_filtered(search_text: str,
                        data: dict,
-                       kill_list: list) -> list:
+                       kill_list: list,
+                       index: dict =None) -> list:
     """ Use the get_value above but filter the resulted
         keys for ones in kill_list, and drop those listed
         there.
@@ -458,39 +801,35 @@ def get_value_filtered(search_text: str,
 
         @param search_text: the key to look for
         @param  data:       the pubchem_search data to dig into
+        @param index:       optional key index of data, passed to get_value
 
         @return: a list of hits
     """
-    if not kill_list:
-        return get_value(search_text, data)
+    res = get_value(search_text, data, index)
 
-    kill = []
-    for i in kill_list:
-        kill += get_value(i, data)
+    if not kill_list or not res:
+        return res
 
-    res = get_value(search_text, data)
+    kill = set().union(*(get_value(i, data, index) for i in kill_list))
 
-    if kill:
-        for i in kill:
-            if i in res:
-                res.remove(i)
-    return res
+    return list(set(res) - kill)
 # end get_value_filtered
 
 
-def get_ghs(info):
+def get_ghs(info, index: dict =None):
     """ Dig out the GHS codes, that is the 'H' and 'P' codes.
         This is a bit brute force analyzing the values, that is
         the descriptions themselves, not the actual dict structure.
 
         @parameter info the pubchem record
+        @parameter index optional key index of the record, see get_value
         @return: dict with 'H-values' and 'P-values'
     """
 
     if not isinstance(info, dict):
         raise ValueError('A pubchem record dict was expected')
 
-    codes = get_value('GHS', info)
+    codes = get_value('GHS', info, index)
     # this list should have two types of values:
     # Hxxx: explanation
     # Pxxx, Pxxx, Pxxx.... list
@@ -500,17 +839,12 @@ def get_ghs(info):
     p_codes = []
     for i in codes:
         if isinstance(i, str):
-            if i.startswith('H') and ':' in i:
-                h_codes.append(i.split(':')[0])
-            elif i.startswith('P') and ',' in i:
-                p_codes += [j.strip() for j in i.split(',')]
-
-
-    # last P value starts with 'and ...'
-    if p_codes and  p_codes[-1].startswith('and'):
-        p_codes[-1] = p_codes[-1].split('and ')[-1]
+            h_codes += _H_RE.findall(i)
+            p_codes += _P_RE.findall(i)
 
-    return {'H-codes': h_codes, 'P-codes': p_codes}
+    # the same code may come from several sources, keep the first one
+    return {'H-codes': list(dict.fromkeys(h_codes)),
+            'P-codes': list(dict.fromkeys(p_codes))}
 # end of get_ghs
 
 